@@ -1,83 +1,269 @@
 import numpy as np
-from sklearn.ensemble import RandomForestClassifier
+import joblib
 from datetime import datetime, timedelta
-import pandas as pd
 from typing import Dict, List, Optional
 import logging
-import json
+import orjson
 import os
+import glob
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import treelite
+    import treelite_runtime
+except ImportError:  # Compiled predictions are optional
+    treelite = None
+    treelite_runtime = None
+
+# Number of new samples to buffer before the forest is refitted
+REFIT_EVERY = 32
+# Only the most recent samples are kept, bounding memory and refit cost
+MAX_TRAINING_SAMPLES = 5000
+# Initial capacity of the sample buffer; doubled as needed up to the maximum
+INITIAL_CAPACITY = 64
+
+TRAINING_DATA_PATH = 'training_data.json'
+MODEL_PATH = 'adk_model.joblib'
+# Every compiled model gets its own library; a loaded library must never be
+# overwritten, and dlopen of an already-loaded path returns the old one
+COMPILED_MODEL_PREFIX = 'compiled_forest-'
 
 class AdaptiveDataKernel:
     def __init__(self):
-        self.model = RandomForestClassifier(n_estimators=100)
+        self.model = None
         self.features = ['hour', 'day_of_week', 'month', 'urgency']
         self.logger = logging.getLogger(__name__)
-        self.training_data = {
-            'features': [],
-            'labels': []
-        }
+        # Training samples live in a preallocated float32 ring buffer; once it
+        # holds MAX_TRAINING_SAMPLES rows the oldest row is overwritten first
+        self._samples = np.empty((INITIAL_CAPACITY, len(self.features)), dtype=np.float32)
+        self._labels = np.empty(INITIAL_CAPACITY, dtype=np.int8)
+        self._size = 0
+        self._start = 0
+        self.predictor = None
+        self._fitted = False
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1)
         self._load_training_data()
 
+    @staticmethod
+    def _new_model():
+        """Create an unfitted model."""
+        # Imported lazily; sklearn is slow to import and only needed here
+        from sklearn.ensemble import RandomForestClassifier
+
+        # Four features need neither many nor deep trees; prediction cost grows
+        # with both. Predictions are made in small batches, where joblib
+        # dispatch dominates, so stay single-threaded.
+        return RandomForestClassifier(
+            n_estimators=25,
+            max_depth=8,
+            min_samples_leaf=5,
+            n_jobs=1,
+            random_state=0
+        )
+
     def _load_training_data(self):
-        """Load historical training data."""
+        """Load historical training data and the last fitted model."""
         try:
-            if os.path.exists('training_data.json'):
-                with open('training_data.json', 'r') as f:
-                    data = json.load(f)
-                    self.training_data = data
-                    if self.training_data['features']:
-                        self.model.fit(
-                            np.array(self.training_data['features']),
-                            np.array(self.training_data['labels'])
-                        )
+            if os.path.exists(TRAINING_DATA_PATH):
+                with open(TRAINING_DATA_PATH, 'rb') as f:
+                    data = orjson.loads(f.read())
+                if data['features']:
+                    samples = np.asarray(data['features'], dtype=np.float32)[-MAX_TRAINING_SAMPLES:]
+                    labels = np.asarray(data['labels'], dtype=np.int8)[-MAX_TRAINING_SAMPLES:]
+                    self._size = len(labels)
+                    capacity = max(INITIAL_CAPACITY, self._size)
+                    self._samples = np.resize(samples, (capacity, len(self.features)))
+                    self._labels = np.resize(labels, capacity)
+
+            # Reuse the persisted model so startup does not pay for a refit
+            libpath = None
+            if os.path.exists(MODEL_PATH):
+                saved = joblib.load(MODEL_PATH)
+                if isinstance(saved, dict):
+                    self.model, libpath = saved['model'], saved['compiled_lib']
+                else:  # Saved before compiled libraries were recorded
+                    self.model = saved
+                self._fitted = True
+            elif self._size:
+                self.model = self._new_model()
+                self.model.fit(*self._snapshot())
+                self._fitted = True
+                self._save_model(self.model, None)
+
+            if self._fitted and treelite_runtime is not None:
+                # Only the library recorded with this model was built from it
+                if libpath and os.path.exists(libpath):
+                    self.predictor = treelite_runtime.Predictor(libpath, verbose=False)
+                else:
+                    self._executor.submit(self._compile_in_background, self.model)
         except Exception as e:
             self.logger.error(f"Error loading training data: {e}")
 
-    def _save_training_data(self):
-        """Save training data to disk."""
+    def _save_training_data(self, samples: np.ndarray, labels: np.ndarray):
+        """Save the raw training samples to disk."""
         try:
-            with open('training_data.json', 'w') as f:
-                json.dump(self.training_data, f)
+            tmp_path = TRAINING_DATA_PATH + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(orjson.dumps({'features': samples, 'labels': labels},
+                                     option=orjson.OPT_SERIALIZE_NUMPY))
+            os.replace(tmp_path, TRAINING_DATA_PATH)
         except Exception as e:
             self.logger.error(f"Error saving training data: {e}")
 
-    def extract_features(self, dt: datetime, urgency: int) -> List[float]:
+    def _save_model(self, model, libpath: Optional[str]):
+        """Save the fitted model, and the library compiled from it, to disk."""
+        try:
+            fd, tmp_path = tempfile.mkstemp(prefix='.' + MODEL_PATH, dir='.')
+            os.close(fd)
+            joblib.dump({'model': model, 'compiled_lib': libpath}, tmp_path, compress=3)
+            os.replace(tmp_path, MODEL_PATH)
+            self._remove_stale_libs(libpath)
+        except Exception as e:
+            self.logger.error(f"Error saving model: {e}")
+
+    @staticmethod
+    def _remove_stale_libs(keep: Optional[str]):
+        """Delete compiled libraries other than the one saved with the model."""
+        for path in glob.glob(f'./{COMPILED_MODEL_PREFIX}*.so'):
+            if keep is None or os.path.normpath(path) != os.path.normpath(keep):
+                # Processes that still have it loaded keep their mapping
+                try:
+                    os.remove(path)
+                except FileNotFoundError:  # Already removed by another instance
+                    pass
+
+    def _compile_model(self, model):
+        """Compile a fitted forest to a native predictor, if treelite is available.
+
+        Returns the predictor and its library path, or (None, None).
+        """
+        if treelite is None or len(model.classes_) != 2:
+            return None, None
+        libpath = f'./{COMPILED_MODEL_PREFIX}{uuid.uuid4().hex}.so'
+        fd, tmp_path = tempfile.mkstemp(prefix='.' + COMPILED_MODEL_PREFIX, suffix='.so', dir='.')
+        os.close(fd)
+        try:
+            compiled = treelite.sklearn.import_model(model)
+            compiled.export_lib(toolchain='gcc', libpath=tmp_path, verbose=False)
+            os.replace(tmp_path, libpath)
+            return treelite_runtime.Predictor(libpath, verbose=False), libpath
+        except Exception as e:
+            self.logger.error(f"Error compiling model: {e}")
+            return None, None
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _compile_in_background(self, model):
+        """Compile the current model and start using it once ready."""
+        predictor, libpath = self._compile_model(model)
+        if self.model is model:
+            self.predictor = predictor
+            self._save_model(model, libpath)
+
+    def _snapshot(self):
+        """Return copies of the stored samples and labels, oldest first."""
+        order = np.arange(self._start, self._start + self._size) % len(self._labels)
+        return self._samples[order], self._labels[order]
+
+    def _append_sample(self, features: np.ndarray, label: int):
+        """Store a sample, growing the buffer or overwriting the oldest row."""
+        capacity = len(self._labels)
+        if self._size == capacity and capacity < MAX_TRAINING_SAMPLES:
+            capacity = min(capacity * 2, MAX_TRAINING_SAMPLES)
+            self._samples = np.resize(self._samples, (capacity, len(self.features)))
+            self._labels = np.resize(self._labels, capacity)
+
+        if self._size < capacity:
+            idx = self._size
+            self._size += 1
+        else:
+            idx = self._start
+            self._start = (self._start + 1) % capacity
+        self._samples[idx] = features
+        self._labels[idx] = label
+
+    def _refit(self, samples: np.ndarray, labels: np.ndarray):
+        """Fit a fresh model on a snapshot of the training data and swap it in."""
+        try:
+            model = self._new_model()
+            model.fit(samples, labels)
+            predictor, libpath = self._compile_model(model)
+            self.model = model
+            self.predictor = predictor
+            self._fitted = True
+            self._save_model(model, libpath)
+            self._save_training_data(samples, labels)
+        except Exception as e:
+            self.logger.error(f"Error refitting model: {e}")
+
+    def extract_features(self, dt: datetime, urgency: int) -> np.ndarray:
         """Extract features from appointment datetime."""
-        return [
+        return np.array([
             dt.hour,
             dt.weekday(),
             dt.month,
             urgency
-        ]
+        ], dtype=np.float32)
+
+    def _predict_proba(self, X: np.ndarray) -> np.ndarray:
+        """Return the probability of the positive class for each row of X."""
+        predictor = self.predictor
+        if predictor is not None:
+            probs = predictor.predict(treelite_runtime.DMatrix(X))
+            return probs[:, -1] if probs.ndim == 2 else probs
+        return self.model.predict_proba(X)[:, 1]
 
     def learn_from_appointment(self, appointment_datetime: datetime, 
                              success: bool, urgency: int):
         """Learn from appointment outcomes."""
         try:
             features = self.extract_features(appointment_datetime, urgency)
-            self.training_data['features'].append(features)
-            self.training_data['labels'].append(1 if success else 0)
-            
-            if len(self.training_data['features']) > 1:
-                self.model.fit(
-                    np.array(self.training_data['features']),
-                    np.array(self.training_data['labels'])
-                )
-                self._save_training_data()
+            with self._lock:
+                self._append_sample(features, 1 if success else 0)
+                self._pending += 1
+
+                if self._pending < REFIT_EVERY or self._size < 2:
+                    return
+                self._pending = 0
+                snapshot = self._snapshot()
+
+            # Refit off the caller's thread so request handlers are not blocked
+            self._executor.submit(self._refit, *snapshot)
         except Exception as e:
             self.logger.error(f"Error learning from appointment: {e}")
 
     def predict_success_probability(self, dt: datetime, urgency: int) -> float:
         """Predict the success probability of an appointment."""
         try:
-            if len(self.training_data['features']) > 1:
-                features = np.array([self.extract_features(dt, urgency)])
-                return float(self.model.predict_proba(features)[0][1])
+            if self._fitted:
+                features = self.extract_features(dt, urgency).reshape(1, -1)
+                return float(self._predict_proba(features)[0])
             return 0.5  # Default probability when no training data
         except Exception as e:
             self.logger.error(f"Error predicting success probability: {e}")
             return 0.5
 
+    def predict_success_probability_batch(self, dts: List[datetime], urgency: int) -> np.ndarray:
+        """Predict success probabilities for many slots with a single model call."""
+        try:
+            if self._fitted and dts:
+                X = np.fromiter(
+                    (v for dt in dts for v in (dt.hour, dt.weekday(), dt.month, urgency)),
+                    dtype=np.float32,
+                    count=len(dts) * len(self.features)
+                ).reshape(-1, len(self.features))
+                return self._predict_proba(X)
+            return np.full(len(dts), 0.5)  # Default probability when no training data
+        except Exception as e:
+            self.logger.error(f"Error predicting success probabilities: {e}")
+            return np.full(len(dts), 0.5)
+
 class ModelContextProtocol:
     def __init__(self):
         self.priority_weights = {
@@ -113,17 +299,28 @@ class ModelContextProtocol:
     def sort_appointments_by_priority(self, appointments: List[Dict]) -> List[Dict]:
         """Sort appointments by their priority scores."""
         try:
-            for appt in appointments:
-                waiting_time = datetime.now() - appt['request_time']
-                score = self.calculate_priority_score(
-                    appt['urgency'],
-                    appt['success_probability'],
-                    waiting_time,
-                    appt['is_preferred_time']
-                )
-                appt['priority_score'] = score
-            
-            return sorted(appointments, key=lambda x: x['priority_score'], reverse=True)
+            if not appointments:
+                return appointments
+
+            now = datetime.now()
+            count = len(appointments)
+            urgency = np.fromiter((a['urgency'] for a in appointments), dtype=float, count=count)
+            success_prob = np.fromiter((a['success_probability'] for a in appointments), dtype=float, count=count)
+            wait_seconds = np.fromiter(((now - a['request_time']).total_seconds() for a in appointments),
+                                       dtype=float, count=count)
+            is_preferred = np.fromiter((a['is_preferred_time'] for a in appointments), dtype=float, count=count)
+
+            # Same weighting as calculate_priority_score, over all appointments at once
+            scores = (
+                self.priority_weights['urgency'] * (urgency / 5.0) +
+                self.priority_weights['success_probability'] * success_prob +
+                self.priority_weights['waiting_time'] * np.minimum(wait_seconds / (7 * 24 * 3600), 1.0) +
+                self.priority_weights['preferred_time'] * is_preferred
+            )
+
+            # Stable sort on the negated scores keeps ties in their original order
+            order = np.argsort(-scores, kind='stable')
+            return [appointments[i] for i in order]
         except Exception as e:
             self.logger.error(f"Error sorting appointments: {e}")
             return appointments 
\ No newline at end of file
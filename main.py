@@ -1,20 +1,23 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from typing import List, Dict, Optional
-import json
+from typing import List, Dict, Optional, Tuple
+from dataclasses import dataclass
+from functools import lru_cache
+import orjson
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
 import asyncio
-from dateutil import parser as date_parser
 import re
 import os
+import sqlite3
+import bisect
 
 from voice_manager import VoiceManager
-from scheduler import AppointmentScheduler, SlotScheduler
-from ai_core import AdaptiveDataKernel, ModelContextProtocol
+from scheduler import AppointmentScheduler, SlotScheduler, connect_db
+from ai_core import ModelContextProtocol
 
 app = FastAPI(title="AI-Powered Voice-Based Appointment Booking System")
 
@@ -39,10 +42,14 @@ templates = Jinja2Templates(directory="templates")
 # Initialize components
 voice_manager = VoiceManager()
 scheduler = AppointmentScheduler()
-adk = AdaptiveDataKernel()
 mcp = ModelContextProtocol()
 slot_scheduler = SlotScheduler()
 
+# Shared read connection for the bookings listing; SlotScheduler's unique
+# (date, time) index serves its ORDER BY
+db_conn = connect_db("appointments.db")
+db_conn.row_factory = sqlite3.Row
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -50,6 +57,86 @@ logger = logging.getLogger(__name__)
 # Store user context
 user_context = {}
 
+# Precompiled patterns for parsing user messages
+_TIME_RE = re.compile(r'\b(\d{1,2})(?::(\d{2}))?\s*(am|pm)?\b', re.IGNORECASE)
+_DOCTOR_RE = re.compile(r'(?:dr\.?|doctor)\s+([a-z]+)')
+_PHONE_RE = re.compile(r'(\d{3}[-\s]?\d{3}[-\s]?\d{4})')
+_PHONE_SEPARATOR_RE = re.compile(r'[-\s]')
+_NAME_RE = re.compile(r'my name is ([a-z ]+)')
+# Full month names and their usual abbreviations; _MONTHS is keyed by the
+# first three letters
+_MONTH_NAMES = (r'(jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?'
+                r'|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)')
+_MONTHS = {name: i for i, name in enumerate(
+    ('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'), start=1)}
+_ISO_DATE_RE = re.compile(r'\b(\d{4})-(\d{1,2})-(\d{1,2})\b')
+# An optional trailing year, as in '25 may 2026' or 'may 25, 2026'
+_YEAR = r'(?:,?\s*(\d{4})\b)?'
+_DAY_MONTH_RE = re.compile(r'\b(\d{1,2})(?:st|nd|rd|th)?\s+(?:of\s+)?' + _MONTH_NAMES + r'\b' + _YEAR)
+_MONTH_DAY_RE = re.compile(r'\b' + _MONTH_NAMES + r'\s+(\d{1,2})(?:st|nd|rd|th)?\b' + _YEAR)
+
+# Relative date phrases as (phrase, days, is_weekday). For weekday phrases the
+# offset is (7 - today.weekday() + days) % 7. Longer phrases come first so that
+# 'day after tomorrow' is not matched as 'tomorrow'.
+_DATE_PHRASES = (
+    ('day after tomorrow', 2, False),
+    ('tomorrow', 1, False),
+    ('today', 0, False),
+    ('next monday', 0, True),
+    ('next tuesday', 1, True),
+    ('next wednesday', 2, True),
+    ('next thursday', 3, True),
+    ('next friday', 4, True),
+)
+
+# Intent keywords, matched as substrings in a single pass. When keywords for
+# several intents appear, the first intent in _INTENT_PRIORITY wins.
+_INTENT_KEYWORDS = {
+    'book': 'schedule', 'schedule': 'schedule', 'make': 'schedule', 'new': 'schedule', 'need': 'schedule',
+    'cancel': 'cancel', 'delete': 'cancel', 'remove': 'cancel',
+    'list': 'list_appointments', 'show': 'list_appointments', 'what': 'list_appointments',
+    'available': 'list_appointments',
+}
+_INTENT_PRIORITY = ('schedule', 'cancel', 'list_appointments')
+_INTENT_RE = re.compile('|'.join(_INTENT_KEYWORDS))
+_BOOKING_RE = re.compile('book|appointment|schedule')
+
+def _match_relative_date(lower_text: str, today: date) -> Optional[date]:
+    """Resolve phrases such as 'tomorrow' or 'next friday' against today."""
+    for phrase, days, is_weekday in _DATE_PHRASES:
+        if phrase in lower_text:
+            if is_weekday:
+                days = (7 - today.weekday() + days) % 7
+            return today + timedelta(days=days)
+    return None
+
+def _parse_time(text: str) -> Optional[Tuple[int, int]]:
+    """Return the time in text as a 24-hour (hour, minute) pair.
+
+    Times written with am/pm or a colon win over bare numbers, which are only
+    used when nothing else matches; out-of-range candidates are skipped.
+    """
+    fallback = None
+    for time_match in _TIME_RE.finditer(text):
+        hour = int(time_match.group(1))
+        minute = int(time_match.group(2)) if time_match.group(2) else 0
+        period = time_match.group(3)
+        if period:
+            period = period.lower()
+            if hour > 12:
+                continue
+        if period == 'pm' and hour < 12:
+            hour += 12
+        elif period == 'am' and hour == 12:
+            hour = 0
+        if hour > 23 or minute > 59:
+            continue
+        if period or time_match.group(2):
+            return hour, minute
+        if fallback is None:
+            fallback = (hour, minute)
+    return fallback
+
 class ConnectionManager:
     def __init__(self):
         self.active_connections: List[WebSocket] = []
@@ -69,67 +156,42 @@ class ConnectionManager:
         if websocket in self.user_contexts:
             del self.user_contexts[websocket]
 
+    async def send_json(self, payload: Dict, websocket: WebSocket):
+        await websocket.send_text(orjson.dumps(payload).decode())
+
     async def send_message(self, message: str, websocket: WebSocket):
-        await websocket.send_json({
+        await self.send_json({
             "type": "response",
             "text": message
-        })
+        }, websocket)
 
 manager = ConnectionManager()
 
 class NLPProcessor:
     @staticmethod
     def extract_date_time(text: str) -> datetime:
-        """Extract date and time from natural language text."""
+        """Extract date and time from lowercased natural language text."""
         today = datetime.now()
-        
-        # Try to find time patterns
-        time_pattern = r'(\d{1,2})(?::(\d{2}))?\s*(am|pm|AM|PM)?'
-        time_match = re.search(time_pattern, text)
-        
-        # Try to find date patterns
-        date_patterns = {
-            'today': today.date(),
-            'tomorrow': (today + timedelta(days=1)).date(),
-            'day after tomorrow': (today + timedelta(days=2)).date(),
-            'next monday': (today + timedelta(days=(7 - today.weekday() + 0) % 7)).date(),
-            'next tuesday': (today + timedelta(days=(7 - today.weekday() + 1) % 7)).date(),
-            'next wednesday': (today + timedelta(days=(7 - today.weekday() + 2) % 7)).date(),
-            'next thursday': (today + timedelta(days=(7 - today.weekday() + 3) % 7)).date(),
-            'next friday': (today + timedelta(days=(7 - today.weekday() + 4) % 7)).date(),
-        }
-        
-        extracted_date = today.date()
-        for pattern, date in date_patterns.items():
-            if pattern in text.lower():
-                extracted_date = date
-                break
-        
+        extracted_date = _match_relative_date(text, today.date()) or today.date()
+
         extracted_time = today.time()
-        if time_match:
-            hour = int(time_match.group(1))
-            minute = int(time_match.group(2)) if time_match.group(2) else 0
-            period = time_match.group(3).lower() if time_match.group(3) else None
-            
-            if period == 'pm' and hour < 12:
-                hour += 12
-            elif period == 'am' and hour == 12:
-                hour = 0
-                
+        parsed_time = _parse_time(text)
+        if parsed_time:
+            hour, minute = parsed_time
             extracted_time = datetime.min.time().replace(hour=hour, minute=minute)
         
         return datetime.combine(extracted_date, extracted_time)
 
     @staticmethod
     def extract_doctor_name(text: str) -> str:
-        """Extract doctor name from text."""
-        doctor_pattern = r'(?:dr\.?|doctor)\s+([a-z]+)'
-        match = re.search(doctor_pattern, text.lower())
+        """Extract doctor name from lowercased text."""
+        match = _DOCTOR_RE.search(text)
         return match.group(1).title() if match else "Smith"  # Default to Dr. Smith
 
     @staticmethod
     def process_intent(text: str) -> Dict:
         """Process the intent of the user's speech."""
+        # Lowercased once here; the extractors below expect lowercased text
         text = text.lower()
         
         # Extract doctor name and datetime
@@ -137,19 +199,21 @@ class NLPProcessor:
         appointment_time = NLPProcessor.extract_date_time(text)
         
         # Basic intent classification
-        if any(word in text for word in ['book', 'schedule', 'make', 'new', 'need']):
+        found = {_INTENT_KEYWORDS[match.group()] for match in _INTENT_RE.finditer(text)}
+        intent = next((name for name in _INTENT_PRIORITY if name in found), 'unknown')
+        if intent == 'schedule':
             return {
                 'intent': 'schedule',
                 'doctor': doctor_name,
                 'datetime': appointment_time,
                 'urgency': 3 if 'urgent' in text else 1
             }
-        elif any(word in text for word in ['cancel', 'delete', 'remove']):
+        elif intent == 'cancel':
             return {
                 'intent': 'cancel',
                 'doctor': doctor_name
             }
-        elif any(word in text for word in ['list', 'show', 'what', 'available']):
+        elif intent == 'list_appointments':
             return {
                 'intent': 'list_appointments',
                 'doctor': doctor_name,
@@ -165,20 +229,14 @@ async def process_voice_input(text: str, websocket: WebSocket):
         response = ""
         
         if intent_data['intent'] == 'schedule':
-            next_slot = scheduler.get_next_available_slot(
-                intent_data['datetime'],
-                intent_data['urgency']
-            )
-            if next_slot:
-                # Get success probability from ADK
-                success_prob = adk.predict_success_probability(
-                    next_slot,
-                    intent_data['urgency']
-                )
+            best = scheduler.get_best_slot(intent_data['datetime'], intent_data['urgency'])
+            if best:
+                next_slot, success_prob = best
                 
                 appointment = scheduler.schedule_appointment(
                     patient_name="Voice User",
                     datetime_slot=next_slot,
+                    doctor=intent_data['doctor'],
                     reason=f"Appointment with Dr. {intent_data['doctor']}",
                     urgency=intent_data['urgency']
                 )
@@ -216,21 +274,21 @@ async def process_voice_input(text: str, websocket: WebSocket):
             )
         
         # Send response through websocket
-        await websocket.send_json({
+        await manager.send_json({
             "type": "response",
             "text": response,
             "intent": intent_data
-        })
+        }, websocket)
         
         # Convert response to speech
         voice_manager.speak(response)
         
     except Exception as e:
         logger.error(f"Error processing voice input: {e}")
-        await websocket.send_json({
+        await manager.send_json({
             "type": "error",
             "text": "Sorry, there was an error processing your request."
-        })
+        }, websocket)
 
 @app.get("/", response_class=HTMLResponse)
 def welcome(request: Request):
@@ -250,67 +308,108 @@ def parse_time_range(phrase):
         return ('16:30', '19:30')
     return (None, None)
 
-def extract_date(text):
-    # Try to extract a date using dateutil.parser
-    try:
-        # Remove time words to avoid confusion
-        text_clean = re.sub(r'\b(\d{1,2}(:\d{2})?\s*(am|pm))\b', '', text, flags=re.IGNORECASE)
-        dt = date_parser.parse(text_clean, fuzzy=True, default=datetime.now())
-        return dt.strftime('%Y-%m-%d')
-    except Exception:
-        return datetime.now().strftime('%Y-%m-%d')
+def extract_date(text, today):
+    # Returns (date in YYYY-MM-DD format, text with the date removed)
+    for pattern in (_ISO_DATE_RE, _DAY_MONTH_RE, _MONTH_DAY_RE):
+        match = pattern.search(text)
+        if not match:
+            continue
+        if pattern is _ISO_DATE_RE:
+            year, month, day = (int(g) for g in match.groups())
+        elif pattern is _DAY_MONTH_RE:
+            year, month, day = match.group(3) or today.year, _MONTHS[match.group(2)[:3]], match.group(1)
+        else:
+            year, month, day = match.group(3) or today.year, _MONTHS[match.group(1)[:3]], match.group(2)
+        try:
+            found = date(int(year), month, int(day))
+        except ValueError:
+            continue
+        return found.strftime('%Y-%m-%d'), text[:match.start()] + text[match.end():]
+    found = _match_relative_date(text, today) or today
+    return found.strftime('%Y-%m-%d'), text
 
 def extract_time(text):
     # Try to extract a time and return in 12-hour format with AM/PM
-    time_match = re.search(r'(\d{1,2})(?::(\d{2}))?\s*(am|pm)?', text, re.IGNORECASE)
-    if time_match:
-        hour = int(time_match.group(1))
-        minute = int(time_match.group(2)) if time_match.group(2) else 0
-        period = time_match.group(3)
-        if period:
-            period = period.lower()
-        if period == 'pm' and hour < 12:
-            hour += 12
-        elif period == 'am' and hour == 12:
-            hour = 0
+    parsed_time = _parse_time(text)
+    if parsed_time:
+        hour, minute = parsed_time
         # Always return 12-hour format with AM/PM
-        t12 = datetime.strptime(f"{hour:02d}:{minute:02d}", "%H:%M").strftime("%I:%M %p")
-        return t12
+        h12 = (hour - 1) % 12 + 1
+        return f"{h12:02d}:{minute:02d} {'PM' if hour >= 12 else 'AM'}"
     return None
 
+@dataclass(frozen=True)
+class ParsedMessage:
+    date: str
+    time: Optional[str]
+    start: Optional[str]
+    end: Optional[str]
+    period: Optional[str]  # 'morning', 'afternoon' or 'evening'
+    phone: Optional[str]
+    name: Optional[str]
+    wants_booking: bool
+
+@lru_cache(maxsize=1024)
+def _parse_message(text: str, today: date) -> ParsedMessage:
+    wants_booking = bool(_BOOKING_RE.search(text))
+
+    # Improved phone extraction (allow dashes/spaces)
+    phone_match = _PHONE_RE.search(text)
+    phone = _PHONE_SEPARATOR_RE.sub('', phone_match.group(1)) if phone_match else None
+    name_match = _NAME_RE.search(text)
+    name = name_match.group(1).strip().title() if name_match else None
+
+    # Drop the phone number and date so their digits are not read as a time
+    if phone_match:
+        text = text[:phone_match.start()] + text[phone_match.end():]
+    date_str, text = extract_date(text, today)
+
+    start = end = period = None
+    for phrase in ['morning', 'afternoon', 'evening']:
+        if phrase in text:
+            start, end = parse_time_range(phrase)
+            period = phrase
+            break
+
+    return ParsedMessage(
+        date=date_str,
+        time=extract_time(text),
+        start=start,
+        end=end,
+        period=period,
+        phone=phone,
+        name=name,
+        wants_booking=wants_booking
+    )
+
+def parse_message(text: str) -> ParsedMessage:
+    """Parse a lowercased user message once; repeated messages hit the cache."""
+    # Keyed on today's date so relative phrases do not go stale
+    return _parse_message(text, date.today())
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await manager.connect(websocket)
     try:
         while True:
-            data = await websocket.receive_json()
+            data = orjson.loads(await websocket.receive_text())
             user_text = data["text"].lower()
             logger.info(f"Received user input: {user_text}")
             context = manager.user_contexts[websocket]
             try:
-                # Extract date and time
-                date_str = extract_date(user_text)
-                time_str = extract_time(user_text)
-                start = end = None
-                for phrase in ['morning', 'afternoon', 'evening']:
-                    if phrase in user_text:
-                        start, end = parse_time_range(phrase)
-                        break
-
-                # Improved phone extraction (allow dashes/spaces)
-                phone_match = re.search(r'(\d{3}[-\s]?\d{3}[-\s]?\d{4})', user_text)
-                if phone_match:
-                    patient_contact = re.sub(r'[-\s]', '', phone_match.group(1))
-                else:
-                    patient_contact = None
-                name_match = re.search(r'my name is ([a-z ]+)', user_text)
-                patient_name = name_match.group(1).strip().title() if name_match else None
+                # Extract date, time, name and phone in one pass
+                parsed = parse_message(user_text)
+                date_str = parsed.date
+                time_str = parsed.time
+                start, end, period = parsed.start, parsed.end, parsed.period
+                patient_contact = parsed.phone
+                patient_name = parsed.name
 
                 # Context memory for date and time
-                if any(word in user_text for word in ["book", "appointment", "schedule"]):
+                if parsed.wants_booking:
                     # If both date and time/range are present, proceed
                     if (time_str or (start and end)) and date_str:
-                        context["pending_booking"] = {"date": date_str, "time": time_str, "start": start, "end": end}
+                        context["pending_booking"] = {"date": date_str, "time": time_str, "start": start, "end": end, "period": period}
                     elif date_str:
                         context["pending_booking"] = {"date": date_str}
                         response = "Please specify the time for your appointment (e.g., 9:00 AM or 'morning')."
@@ -318,7 +417,7 @@ async def websocket_endpoint(websocket: WebSocket):
                         voice_manager.speak(response)
                         continue
                     elif time_str or (start and end):
-                        context["pending_booking"] = {"time": time_str, "start": start, "end": end}
+                        context["pending_booking"] = {"time": time_str, "start": start, "end": end, "period": period}
                         response = "Please specify the date for your appointment (e.g., 25 May)."
                         await manager.send_message(response, websocket)
                         voice_manager.speak(response)
@@ -336,6 +435,8 @@ async def websocket_endpoint(websocket: WebSocket):
                         pending["start"] = start
                     if "end" not in pending and end:
                         pending["end"] = end
+                    if "period" not in pending and period:
+                        pending["period"] = period
                 # If we have both date and time/range, proceed to booking
                 if "pending_booking" in context and (context["pending_booking"].get("time") or (context["pending_booking"].get("start") and context["pending_booking"].get("end"))) and context["pending_booking"].get("date"):
                     booking = context.pop("pending_booking")
@@ -343,21 +444,28 @@ async def websocket_endpoint(websocket: WebSocket):
                     time_str = booking.get("time")
                     start = booking.get("start")
                     end = booking.get("end")
+                    period = booking.get("period")
                     slots = slot_scheduler.get_slots_for_day(date_str)
+                    # Slots are ordered by time, so lookups can bisect on the time strings
+                    times = [s[2] for s in slots]
                     slot = None
                     if time_str:
                         # time_str is already in 12-hour format
-                        slot = next((s for s in slots if s[2] == time_str), None)
+                        idx = bisect.bisect_left(times, time_str)
+                        if idx < len(times) and times[idx] == time_str:
+                            slot = slots[idx]
                         if slot and slot[3] == "Available":
                             context["pending_slot"] = {"date": date_str, "time": time_str}
                             if not patient_name or not patient_contact:
                                 response = f"Please provide your name and 10-digit phone number to confirm the booking for {time_str}."
                             else:
                                 booking_number = slot_scheduler.book_slot(date_str, time_str, patient_name, patient_contact)
-                                response = f"Your appointment is confirmed! Booking Number: {booking_number}. Thank you for visiting."
-                                context.clear()
+                                if booking_number:
+                                    response = f"Your appointment is confirmed! Booking Number: {booking_number}. Thank you for visiting."
+                                    context.clear()
+                                else:
+                                    response = f"Sorry, the slot on {date_str} at {time_str} was just booked. Please choose another time."
                         elif slot and slot[3] == "Booked":
-                            idx = slots.index(slot)
                             suggestions = []
                             if idx > 0 and slots[idx-1][3] == "Available":
                                 suggestions.append(slots[idx-1][2])
@@ -371,17 +479,22 @@ async def websocket_endpoint(websocket: WebSocket):
                         else:
                             response = f"Sorry, there is no slot available on {date_str} at {time_str}. Please choose another time."
                     elif start and end:
-                        slot = next((s for s in slots if start <= s[2] <= end and s[3] == "Available"), None)
+                        lo = bisect.bisect_left(times, start)
+                        hi = bisect.bisect_right(times, end)
+                        slot = next((s for s in slots[lo:hi] if s[3] == "Available"), None)
                         if slot:
                             context["pending_slot"] = {"date": date_str, "time": slot[2]}
                             if not patient_name or not patient_contact:
-                                response = f"The first available slot in the {phrase} is {slot[2]}. Please provide your name and 10-digit phone number to confirm the booking."
+                                response = f"The first available slot in the {period} is {slot[2]}. Please provide your name and 10-digit phone number to confirm the booking."
                             else:
                                 booking_number = slot_scheduler.book_slot(date_str, slot[2], patient_name, patient_contact)
-                                response = f"Your appointment is confirmed for {slot[2]}! Booking Number: {booking_number}. Thank you for visiting."
-                                context.clear()
+                                if booking_number:
+                                    response = f"Your appointment is confirmed for {slot[2]}! Booking Number: {booking_number}. Thank you for visiting."
+                                    context.clear()
+                                else:
+                                    response = f"Sorry, the slot on {date_str} at {slot[2]} was just booked. Please choose another time."
                         else:
-                            response = f"Sorry, there are no available slots in the {phrase} on {date_str}. Please choose another time or day."
+                            response = f"Sorry, there are no available slots in the {period} on {date_str}. Please choose another time or day."
                     else:
                         response = "Please specify the time for your appointment (e.g., 9:00 AM or 'morning')."
                     await manager.send_message(response, websocket)
@@ -391,7 +504,10 @@ async def websocket_endpoint(websocket: WebSocket):
                 if "pending_slot" in context and (patient_name and patient_contact):
                     slot_info = context.pop("pending_slot")
                     booking_number = slot_scheduler.book_slot(slot_info["date"], slot_info["time"], patient_name, patient_contact)
-                    response = f"Your appointment is confirmed! Booking Number: {booking_number}. Thank you for visiting."
+                    if booking_number:
+                        response = f"Your appointment is confirmed! Booking Number: {booking_number}. Thank you for visiting."
+                    else:
+                        response = f"Sorry, the slot on {slot_info['date']} at {slot_info['time']} was just booked. Please choose another time."
                     context.clear()
                     await manager.send_message(response, websocket)
                     voice_manager.speak(response)
@@ -423,25 +539,18 @@ async def websocket_endpoint(websocket: WebSocket):
         manager.disconnect(websocket)
         logger.info("Client disconnected")
 
-@app.get("/bookings")
-def get_bookings():
+def fetch_bookings() -> List[Dict]:
     # Return all slots with a booking number (i.e., booked slots)
-    bookings = []
-    import sqlite3
-    conn = sqlite3.connect("appointments.db")
-    cursor = conn.cursor()
-    cursor.execute("SELECT booking_number, date, time, patient_name, patient_contact, status FROM slots WHERE booking_number IS NOT NULL ORDER BY date, time")
-    for row in cursor.fetchall():
-        bookings.append({
-            "booking_number": row[0],
-            "date": row[1],
-            "time": row[2],
-            "name": row[3],
-            "phone": row[4],
-            "status": row[5]
-        })
-    conn.close()
-    return JSONResponse(content=bookings)
+    rows = db_conn.execute(
+        "SELECT booking_number, date, time, patient_name AS name, patient_contact AS phone, status "
+        "FROM slots WHERE booking_number IS NOT NULL ORDER BY date, time"
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+@app.get("/bookings")
+async def get_bookings():
+    bookings = await asyncio.to_thread(fetch_bookings)
+    return Response(content=orjson.dumps(bookings), media_type="application/json")
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,12 +1,54 @@
-from datetime import datetime, timedelta
-from typing import List, Dict, Optional
-import json
-import os
-from dataclasses import dataclass, asdict
-from dateutil.parser import parse
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Optional, Tuple
+from contextlib import contextmanager
+from collections import OrderedDict
+from dataclasses import dataclass
 import logging
+import os
+import orjson
 from ai_core import AdaptiveDataKernel, ModelContextProtocol
 import sqlite3
+import threading
+import numpy as np
+from sortedcontainers import SortedList
+
+# Appointments were stored here before the database became the source of truth
+LEGACY_APPOINTMENTS_PATH = 'appointments.json'
+# Number of days whose slots SlotScheduler keeps cached
+DAY_CACHE_SIZE = 64
+
+def connect_db(db_path: str) -> sqlite3.Connection:
+    """Open a long-lived autocommit connection with WAL enabled."""
+    conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+    # WAL lets readers proceed while a writer commits
+    conn.executescript('''
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+        PRAGMA temp_store=MEMORY;
+        PRAGMA mmap_size=268435456;
+        PRAGMA cache_size=-20000;
+    ''')
+    return conn
+
+def _local_to_utc_text(value: str) -> str:
+    """Render a naive local ISO timestamp the way CURRENT_TIMESTAMP stores it."""
+    return datetime.fromisoformat(value).astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+def _utc_text_to_local(value: str) -> datetime:
+    """Parse a CURRENT_TIMESTAMP value (UTC) into a naive local datetime."""
+    return datetime.fromisoformat(value).replace(tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+
+@contextmanager
+def _transaction(conn: sqlite3.Connection, lock: threading.Lock):
+    """Run the enclosed statements as one write transaction."""
+    with lock:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
 
 @dataclass
 class Appointment:
@@ -23,147 +65,205 @@ class Appointment:
 class AppointmentScheduler:
     def __init__(self):
         self.appointments: Dict[str, Appointment] = {}
+        # (start, end) epoch seconds of every active appointment, kept sorted
+        self._busy = SortedList()
         self.working_hours = {
             'start': 9,  # 9 AM
             'end': 17,   # 5 PM
             'slot_duration': 30  # minutes
         }
+        # Slot layout of a working day, derived once from working_hours
+        slot_duration = self.working_hours['slot_duration']
+        self._slot_seconds = slot_duration * 60
+        self._start_t = datetime.min.time().replace(hour=self.working_hours['start'])
+        self._end_t = datetime.min.time().replace(hour=self.working_hours['end'])
+        self._slot_grid = tuple(
+            divmod(minutes, 60)
+            for minutes in range(self.working_hours['start'] * 60, self.working_hours['end'] * 60, slot_duration)
+        )
         self.logger = logging.getLogger(__name__)
         self.adk = AdaptiveDataKernel()
         self.mcp = ModelContextProtocol()
         self.db_path = "appointments.db"
+        self.conn = connect_db(self.db_path)
+        self._write_lock = threading.Lock()
         self._init_db()
+        self._import_legacy_appointments()
         self._load_appointments()
 
     def _init_db(self):
-        """Initialize the SQLite database."""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Create appointments table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS appointments (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    patient_name TEXT NOT NULL,
-                    email TEXT,
-                    datetime_slot TIMESTAMP NOT NULL,
-                    doctor TEXT NOT NULL,
-                    reason TEXT,
-                    urgency INTEGER DEFAULT 1,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
+        """Initialize the SQLite database.
+
+        Errors are not swallowed: booking relies on the unique slot index, so
+        the scheduler must not start without it.
+        """
+        cursor = self.conn.cursor()
+        
+        # Create appointments table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS appointments (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                patient_name TEXT NOT NULL,
+                email TEXT,
+                datetime_slot INTEGER NOT NULL,  -- epoch seconds
+                doctor TEXT NOT NULL,
+                reason TEXT,
+                urgency INTEGER DEFAULT 1,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                status TEXT NOT NULL DEFAULT 'scheduled'
+            )
+        ''')
+        
+        # Create slots table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS slots (
+                booking_number TEXT,
+                date TEXT NOT NULL,
+                time TEXT NOT NULL,
+                status TEXT NOT NULL,
+                patient_name TEXT,
+                patient_contact TEXT
+            )
+        ''')
+
+        with _transaction(self.conn, self._write_lock) as conn:
+            # Older databases predate the status column
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(appointments)')}
+            if 'status' not in columns:
+                conn.execute('''
+                    ALTER TABLE appointments ADD COLUMN status TEXT NOT NULL DEFAULT 'scheduled'
+                ''')
+
+            # Older databases stored slots as local-time text
+            conn.execute('''
+                UPDATE appointments
+                SET datetime_slot = CAST(strftime('%s', datetime_slot, 'utc') AS INTEGER)
+                WHERE typeof(datetime_slot) = 'text'
             ''')
-            
-            # Create slots table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS slots (
-                    booking_number TEXT,
-                    date TEXT NOT NULL,
-                    time TEXT NOT NULL,
-                    status TEXT NOT NULL,
-                    patient_name TEXT,
-                    patient_contact TEXT
-                )
+
+            # One scheduled appointment per slot, enforced by the database;
+            # cancelled rows free their slot for rebooking. Fails if existing
+            # rows already double-book a slot.
+            conn.execute('''
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_appt_active_slot ON appointments(datetime_slot)
+                WHERE status = 'scheduled'
             ''')
-            
-            conn.commit()
-            conn.close()
+
+    def _import_legacy_appointments(self):
+        """Move appointments from the old JSON store into the database, once."""
+        if not os.path.exists(LEGACY_APPOINTMENTS_PATH):
+            return
+        try:
+            with open(LEGACY_APPOINTMENTS_PATH, 'rb') as f:
+                records = orjson.loads(f.read())
+            rows = []
+            for record in records:
+                reason = record.get('reason')
+                # The JSON store only kept the doctor inside the reason text
+                _, found, doctor = (reason or '').rpartition('Dr. ')
+                rows.append((
+                    record['patient_name'],
+                    int(datetime.fromisoformat(record['datetime']).timestamp()),
+                    doctor if found else 'Unknown',
+                    reason,
+                    record.get('urgency', 1),
+                    record.get('status', 'scheduled'),
+                    # created_at holds UTC, like CURRENT_TIMESTAMP
+                    _local_to_utc_text(record['request_time']) if record.get('request_time') else None
+                ))
+            with _transaction(self.conn, self._write_lock) as conn:
+                # Slots already booked in the database keep their booking
+                conn.executemany('''
+                    INSERT INTO appointments (patient_name, datetime_slot, doctor, reason, urgency, status, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(datetime_slot) WHERE status = 'scheduled' DO NOTHING
+                ''', rows)
+            os.replace(LEGACY_APPOINTMENTS_PATH, LEGACY_APPOINTMENTS_PATH + '.imported')
+            self.logger.info(f"Imported {len(rows)} appointments from {LEGACY_APPOINTMENTS_PATH}")
         except Exception as e:
-            self.logger.error(f"Database initialization error: {e}")
+            self.logger.error(f"Error importing legacy appointments: {e}")
 
     def _load_appointments(self):
-        """Load appointments from storage."""
+        """Load appointments from the database."""
         try:
-            if os.path.exists('appointments.json'):
-                with open('appointments.json', 'r') as f:
-                    data = json.load(f)
-                    for appt_data in data:
-                        appt_data['datetime'] = parse(appt_data['datetime'])
-                        if 'request_time' in appt_data and appt_data['request_time']:
-                            appt_data['request_time'] = parse(appt_data['request_time'])
-                        self.appointments[appt_data['id']] = Appointment(**appt_data)
+            cursor = self.conn.execute('''
+                SELECT id, patient_name, datetime_slot, status, reason, urgency, created_at
+                FROM appointments
+            ''')
+            busy = []
+            for row in cursor:
+                appointment = Appointment(
+                    id=str(row[0]),
+                    patient_name=row[1],
+                    datetime=datetime.fromtimestamp(row[2]),
+                    duration=self.working_hours['slot_duration'],
+                    status=row[3],
+                    reason=row[4],
+                    urgency=row[5],
+                    request_time=_utc_text_to_local(row[6]) if row[6] else None
+                )
+                self.appointments[appointment.id] = appointment
+                if appointment.status != 'cancelled':
+                    busy.append(self._interval(appointment))
+            self._busy = SortedList(busy)
         except Exception as e:
             self.logger.error(f"Error loading appointments: {e}")
 
-    def _save_appointments(self):
-        """Save appointments to storage."""
-        try:
-            data = []
-            for appointment in self.appointments.values():
-                appt_dict = asdict(appointment)
-                appt_dict['datetime'] = appt_dict['datetime'].isoformat()
-                if appt_dict['request_time']:
-                    appt_dict['request_time'] = appt_dict['request_time'].isoformat()
-                data.append(appt_dict)
-            
-            with open('appointments.json', 'w') as f:
-                json.dump(data, f, indent=2)
-        except Exception as e:
-            self.logger.error(f"Error saving appointments: {e}")
+    @staticmethod
+    def _interval(appointment: Appointment):
+        """Return the (start, end) epoch seconds covered by an appointment."""
+        start = appointment.datetime.timestamp()
+        return (start, start + appointment.duration * 60)
 
     def get_available_slots(self, date: datetime) -> List[datetime]:
         """Get available appointment slots for a given date."""
-        slots = []
-        start_time = datetime.combine(date.date(), 
-                                    datetime.min.time().replace(hour=self.working_hours['start']))
-        end_time = datetime.combine(date.date(), 
-                                  datetime.min.time().replace(hour=self.working_hours['end']))
-        
-        current_slot = start_time
-        while current_slot < end_time:
-            if not self._is_slot_taken(current_slot):
-                # Get success probability from ADK
-                success_prob = self.adk.predict_success_probability(current_slot, 1)
-                if success_prob >= 0.5:  # Only include slots with good success probability
-                    slots.append(current_slot)
-            current_slot += timedelta(minutes=self.working_hours['slot_duration'])
-        
-        return slots
+        day = date.date()
+        start_time = datetime.combine(day, self._start_t)
+        end_time = datetime.combine(day, self._end_t)
+        slot_seconds = self._slot_seconds
 
-    def _is_slot_taken(self, datetime_slot: datetime) -> bool:
-        """Check if a time slot is already taken."""
-        for appointment in self.appointments.values():
-            if appointment.status == 'cancelled':
-                continue
-            
-            appt_end = appointment.datetime + timedelta(minutes=appointment.duration)
-            slot_end = datetime_slot + timedelta(minutes=self.working_hours['slot_duration'])
-            
-            if (datetime_slot <= appointment.datetime < slot_end or
-                datetime_slot < appt_end <= slot_end):
-                return True
-        return False
+        slot_starts = np.arange(int(start_time.timestamp()), int(end_time.timestamp()), slot_seconds,
+                                dtype=np.int64)
+        fromtimestamp = datetime.fromtimestamp
+        slots = [fromtimestamp(t) for t in slot_starts.tolist()]
+
+        # Score every slot with the ADK in one call, then drop taken slots and
+        # those without a good success probability
+        success_probs = self.adk.predict_success_probability_batch(slots, 1)
+        mask = (success_probs >= 0.5) & ~self._busy_mask(slot_starts, slot_seconds)
+        return [slot for slot, keep in zip(slots, mask.tolist()) if keep]
+
+    def _busy_mask(self, slot_starts: np.ndarray, slot_seconds: int) -> np.ndarray:
+        """Return which of the given slots overlap an active appointment."""
+        # Only appointments near the queried range can overlap it
+        window = list(self._busy.irange((slot_starts[0] - slot_seconds,), (slot_starts[-1] + slot_seconds,)))
+        if not window:
+            return np.zeros(len(slot_starts), dtype=bool)
+        busy = np.array(window, dtype=np.float64)
+        # The last appointment starting before each slot ends is the only one
+        # that can overlap it, since all appointments share one duration; the
+        # slot is busy if that appointment runs past the slot's start
+        idx = np.searchsorted(busy[:, 0], slot_starts + slot_seconds, side='left') - 1
+        return (idx >= 0) & (busy[np.maximum(idx, 0), 1] > slot_starts)
 
     def schedule_appointment(self, patient_name: str, datetime_slot: datetime, 
                            doctor: str, reason: str, urgency: int = 1, 
                            email: str = None) -> Optional[Appointment]:
         """Schedule a new appointment."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Check if slot is still available
-            cursor.execute('''
-                SELECT COUNT(*) FROM appointments 
-                WHERE datetime_slot = ?
-            ''', (datetime_slot,))
-            
-            if cursor.fetchone()[0] > 0:
-                conn.close()
+            # Insert unless the slot is taken; the unique index makes this race-free
+            with _transaction(self.conn, self._write_lock) as conn:
+                cursor = conn.execute('''
+                    INSERT INTO appointments (patient_name, email, datetime_slot, doctor, reason, urgency)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(datetime_slot) WHERE status = 'scheduled' DO NOTHING
+                ''', (patient_name, email, int(datetime_slot.timestamp()), doctor, reason, urgency))
+
+            if cursor.rowcount == 0:
                 return None
-            
-            # Insert new appointment
-            cursor.execute('''
-                INSERT INTO appointments (patient_name, email, datetime_slot, doctor, reason, urgency)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (patient_name, email, datetime_slot, doctor, reason, urgency))
-            
             appointment_id = cursor.lastrowid
-            conn.commit()
-            conn.close()
             
-            return Appointment(
+            appointment = Appointment(
                 id=str(appointment_id),
                 patient_name=patient_name,
                 datetime=datetime_slot,
@@ -174,6 +274,9 @@ class AppointmentScheduler:
                 request_time=datetime.now(),
                 is_preferred_time=False
             )
+            self.appointments[appointment.id] = appointment
+            self._busy.add(self._interval(appointment))
+            return appointment
         except Exception as e:
             self.logger.error(f"Error scheduling appointment: {e}")
             return None
@@ -183,6 +286,12 @@ class AppointmentScheduler:
         try:
             if appointment_id in self.appointments:
                 appointment = self.appointments[appointment_id]
+                with _transaction(self.conn, self._write_lock) as conn:
+                    conn.execute('''
+                        UPDATE appointments SET status = 'cancelled' WHERE id = ?
+                    ''', (appointment_id,))
+                if appointment.status != 'cancelled':
+                    self._busy.discard(self._interval(appointment))
                 appointment.status = 'cancelled'
                 
                 # Learn from cancellation
@@ -192,7 +301,6 @@ class AppointmentScheduler:
                     appointment.urgency
                 )
                 
-                self._save_appointments()
                 return True
             return False
         except Exception as e:
@@ -201,47 +309,53 @@ class AppointmentScheduler:
 
     def get_next_available_slot(self, preferred_date: datetime, urgency: int) -> Optional[datetime]:
         """Get the next available appointment slot."""
+        candidates = self.get_candidate_slots(preferred_date)
+        return candidates[0] if candidates else None
+
+    def get_best_slot(self, preferred_date: datetime, urgency: int) -> Optional[Tuple[datetime, float]]:
+        """Get the free slot in the next two weeks most likely to succeed.
+
+        Returns the slot and its success probability; ties go to the earliest slot.
+        """
+        candidates = self.get_candidate_slots(preferred_date)
+        if not candidates:
+            return None
+        # Score every free slot in one ADK call and take the best
+        success_probs = self.adk.predict_success_probability_batch(candidates, urgency)
+        best = int(np.argmax(success_probs))
+        return candidates[best], float(success_probs[best])
+
+    def get_candidate_slots(self, preferred_date: datetime, days: int = 14) -> List[datetime]:
+        """Get all free appointment slots in the window starting at preferred_date."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Business hours: 9 AM to 5 PM
-            start_hour = 9
-            end_hour = 17
-            slot_duration = 30  # minutes
-            
-            # Check slots for the next 14 days
-            for day_offset in range(14):
-                check_date = preferred_date + timedelta(days=day_offset)
-                
+            cursor = self.conn.cursor()
+
+            window_start = preferred_date.replace(hour=0, minute=0, second=0, microsecond=0)
+            window_end = window_start + timedelta(days=days)
+            cursor.execute('''
+                SELECT datetime_slot FROM appointments
+                WHERE datetime_slot >= ? AND datetime_slot < ? AND status = 'scheduled'
+            ''', (int(window_start.timestamp()), int(window_end.timestamp())))
+            taken = {row[0] for row in cursor.fetchall()}
+
+            now = datetime.now()
+            slot_grid = self._slot_grid
+            slots = []
+            for day_offset in range(days):
+                check_date = window_start + timedelta(days=day_offset)
+
                 # Skip weekends
                 if check_date.weekday() >= 5:
                     continue
-                
-                # Check each time slot
-                for hour in range(start_hour, end_hour):
-                    for minute in [0, 30]:
-                        slot_time = check_date.replace(hour=hour, minute=minute, second=0, microsecond=0)
-                        
-                        # Don't check past slots
-                        if slot_time < datetime.now():
-                            continue
-                        
-                        # Check if slot is available
-                        cursor.execute('''
-                            SELECT COUNT(*) FROM appointments 
-                            WHERE datetime_slot = ?
-                        ''', (slot_time,))
-                        
-                        if cursor.fetchone()[0] == 0:
-                            conn.close()
-                            return slot_time
-            
-            conn.close()
-            return None
+
+                for hour, minute in slot_grid:
+                    slot_time = check_date.replace(hour=hour, minute=minute)
+                    if slot_time >= now and int(slot_time.timestamp()) not in taken:
+                        slots.append(slot_time)
+            return slots
         except Exception as e:
-            self.logger.error(f"Error getting available slot: {e}")
-            return None
+            self.logger.error(f"Error getting candidate slots: {e}")
+            return []
 
     def get_appointment_by_id(self, appointment_id: str) -> Optional[Appointment]:
         """Retrieve an appointment by its ID."""
@@ -250,33 +364,30 @@ class AppointmentScheduler:
     def get_appointments_for_date(self, date: datetime) -> List[Appointment]:
         """Get all appointments for a specific date."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            cursor = self.conn.cursor()
             
             start_of_day = date.replace(hour=0, minute=0, second=0, microsecond=0)
             end_of_day = start_of_day + timedelta(days=1)
             
             cursor.execute('''
-                SELECT id, patient_name, email, datetime_slot, doctor, reason, urgency
+                SELECT id, patient_name, email, datetime_slot, doctor, reason, urgency, status
                 FROM appointments 
-                WHERE datetime_slot >= ? AND datetime_slot < ?
+                WHERE datetime_slot >= ? AND datetime_slot < ? AND status = 'scheduled'
                 ORDER BY datetime_slot
-            ''', (start_of_day, end_of_day))
+            ''', (int(start_of_day.timestamp()), int(end_of_day.timestamp())))
             
             appointments = []
             for row in cursor.fetchall():
                 appointments.append(Appointment(
                     id=str(row[0]),
                     patient_name=row[1],
-                    email=row[2],
-                    datetime=datetime.fromisoformat(row[3]),
+                    datetime=datetime.fromtimestamp(row[3]),
                     duration=self.working_hours['slot_duration'],
-                    status='scheduled',
+                    status=row[7],
                     reason=row[5],
                     urgency=row[6]
                 ))
             
-            conn.close()
             return appointments
         except Exception as e:
             self.logger.error(f"Error getting appointments: {e}")
@@ -286,70 +397,98 @@ class SlotScheduler:
     def __init__(self):
         self.logger = logging.getLogger(__name__)
         self.db_path = "appointments.db"
+        self.conn = connect_db(self.db_path)
+        self._write_lock = threading.Lock()
+        # Slots per day, least recently used first; invalidated whenever that
+        # day's slots are written
+        self._day_cache: 'OrderedDict[str, list]' = OrderedDict()
         self._init_db()
 
     def _init_db(self):
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS slots (
-                    booking_number TEXT,
-                    date TEXT NOT NULL,
-                    time TEXT NOT NULL,
-                    status TEXT NOT NULL,
-                    patient_name TEXT,
-                    patient_contact TEXT
-                )
-            ''')
-            conn.commit()
-            conn.close()
-        except Exception as e:
-            self.logger.error(f"Database initialization error: {e}")
+        """Initialize the slot tables.
+
+        Errors are not swallowed: populating and booking rely on the unique
+        (date, time) index and the counters table.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS slots (
+                booking_number TEXT,
+                date TEXT NOT NULL,
+                time TEXT NOT NULL,
+                status TEXT NOT NULL,
+                patient_name TEXT,
+                patient_contact TEXT
+            )
+        ''')
+
+        # Last issued booking number, continuing from any existing bookings
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS counters (
+                name TEXT PRIMARY KEY,
+                n INTEGER NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            INSERT OR IGNORE INTO counters (name, n)
+            SELECT 'booking', COUNT(*) FROM slots WHERE status = 'Booked'
+        ''')
+
+        # One slot per date and time; fails if existing rows are duplicated
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_slot_dt ON slots(date, time)
+        ''')
 
     def populate_slots_for_day(self, day: str):
         """Populate slots for a specific day (YYYY-MM-DD) if not already present."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
         start_time = datetime.strptime(day + ' 09:00', '%Y-%m-%d %H:%M')
         end_time = datetime.strptime(day + ' 19:30', '%Y-%m-%d %H:%M')
+        rows = []
         slot_time = start_time
         while slot_time <= end_time:
-            time_str = slot_time.strftime('%H:%M')
-            # Check if slot exists
-            cursor.execute('SELECT COUNT(*) FROM slots WHERE date=? AND time=?', (day, time_str))
-            if cursor.fetchone()[0] == 0:
-                cursor.execute('''
-                    INSERT INTO slots (booking_number, date, time, status, patient_name, patient_contact)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (None, day, time_str, 'Available', None, None))
+            # Slots are stored in the 12-hour form the booking flow looks up
+            rows.append((None, day, slot_time.strftime('%I:%M %p'), 'Available', None, None))
             slot_time += timedelta(minutes=30)
-        conn.commit()
-        conn.close()
+        with _transaction(self.conn, self._write_lock) as conn:
+            # Existing slots are skipped by the unique (date, time) index
+            conn.executemany('''
+                INSERT OR IGNORE INTO slots (booking_number, date, time, status, patient_name, patient_contact)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', rows)
+        self._day_cache.pop(day, None)
 
     def book_slot(self, day: str, time: str, patient_name: str, patient_contact: str):
-        """Book a slot by updating its status and patient info."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        # Find the next booking number
-        cursor.execute('SELECT COUNT(*) FROM slots WHERE status="Booked"')
-        booking_count = cursor.fetchone()[0] + 1
-        booking_number = f"BOOK-{booking_count}"
-        cursor.execute('''
-            UPDATE slots SET booking_number=?, status=?, patient_name=?, patient_contact=?
-            WHERE date=? AND time=? AND status="Available"
-        ''', (booking_number, 'Booked', patient_name, patient_contact, day, time))
-        conn.commit()
-        conn.close()
-        return booking_number
+        """Book a slot by updating its status and patient info.
+
+        Returns the booking number, or None if the slot is not available.
+        """
+        with _transaction(self.conn, self._write_lock) as conn:
+            cursor = conn.cursor()
+            # Take the next booking number
+            cursor.execute("UPDATE counters SET n = n + 1 WHERE name = 'booking' RETURNING n")
+            booking_number = f"BOOK-{cursor.fetchone()[0]}"
+            cursor.execute('''
+                UPDATE slots SET booking_number=?, status=?, patient_name=?, patient_contact=?
+                WHERE date=? AND time=? AND status='Available'
+            ''', (booking_number, 'Booked', patient_name, patient_contact, day, time))
+            booked = cursor.rowcount > 0
+            if not booked:
+                # Give the unused number back
+                cursor.execute("UPDATE counters SET n = n - 1 WHERE name = 'booking'")
+        self._day_cache.pop(day, None)
+        return booking_number if booked else None
 
     def get_slots_for_day(self, day: str):
         """Return all slots for a given day."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM slots WHERE date=? ORDER BY time', (day,))
-        slots = cursor.fetchall()
-        conn.close()
+        slots = self._day_cache.get(day)
+        if slots is None:
+            slots = self.conn.execute('SELECT * FROM slots WHERE date=? ORDER BY time', (day,)).fetchall()
+            self._day_cache[day] = slots
+            # Days come from user input, so bound the cache
+            if len(self._day_cache) > DAY_CACHE_SIZE:
+                self._day_cache.popitem(last=False)
+        else:
+            self._day_cache.move_to_end(day)
         return slots
 
 # Example usage to pre-populate 2025-05-25:
@@ -357,20 +496,22 @@ if __name__ == "__main__":
     scheduler = SlotScheduler()
     scheduler.populate_slots_for_day('2025-05-25')
     # Book the specified slots
-    scheduler.book_slot('2025-05-25', '10:00', 'Alice', '1234567890')
-    scheduler.book_slot('2025-05-25', '12:30', 'Bob', '2345678901')
-    scheduler.book_slot('2025-05-25', '14:30', 'Charlie', '3456789012')
-    scheduler.book_slot('2025-05-25', '17:00', 'Diana', '4567890123')
-    scheduler.book_slot('2025-05-25', '18:30', 'Eve', '5678901234')
-    # Convert all slot times to 12-hour format with AM/PM
+    scheduler.book_slot('2025-05-25', '10:00 AM', 'Alice', '1234567890')
+    scheduler.book_slot('2025-05-25', '12:30 PM', 'Bob', '2345678901')
+    scheduler.book_slot('2025-05-25', '02:30 PM', 'Charlie', '3456789012')
+    scheduler.book_slot('2025-05-25', '05:00 PM', 'Diana', '4567890123')
+    scheduler.book_slot('2025-05-25', '06:30 PM', 'Eve', '5678901234')
+    # Convert any legacy 24-hour slot times to 12-hour format in a single
+    # statement, leaving rows whose 12-hour form already exists alone
     conn = sqlite3.connect('appointments.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT rowid, time FROM slots")
-    updates = []
-    for rowid, time24 in cursor.fetchall():
-        t12 = datetime.strptime(time24, '%H:%M').strftime('%I:%M %p')
-        updates.append((t12, rowid))
-    cursor.executemany("UPDATE slots SET time=? WHERE rowid=?", updates)
+    conn.create_function('to12h', 1, lambda t: datetime.strptime(t, '%H:%M').strftime('%I:%M %p'),
+                         deterministic=True)
+    conn.execute('''
+        UPDATE slots SET time = to12h(time)
+        WHERE time LIKE '__:__' AND NOT EXISTS (
+            SELECT 1 FROM slots AS other WHERE other.date = slots.date AND other.time = to12h(slots.time)
+        )
+    ''')
     conn.commit()
     conn.close()
     # Print all slots for the day
@@ -4,25 +4,79 @@ import threading
 import queue
 import logging
 import time
-from typing import Optional, Callable
+import os
+import orjson
+import tempfile
+import wave
+from collections import OrderedDict
+from typing import Optional, Callable, Tuple
+
+try:
+    import vosk
+except ImportError:  # Offline recognition is optional
+    vosk = None
+
+try:
+    import simpleaudio
+except ImportError:  # Without it every utterance goes through the TTS engine
+    simpleaudio = None
+
+# Directory of an unpacked Vosk model, e.g. vosk-model-small-en-us-0.15
+VOSK_MODEL_PATH = os.environ.get('VOSK_MODEL_PATH', 'model-small-en-us')
+# Vosk results below this mean word confidence are re-checked with Google
+VOSK_MIN_CONFIDENCE = 0.6
+VOSK_SAMPLE_RATE = 16000
+# Number of synthesized phrases kept for replay
+TTS_CACHE_SIZE = 64
+# Number of recently spoken phrases remembered to spot repeats
+TTS_SEEN_SIZE = 256
+# Captured phrases waiting for recognition before capture blocks
+AUDIO_QUEUE_SIZE = 4
+
+# pyttsx3 engines are expensive to create, so every VoiceManager shares one;
+# the lock also keeps workers of different managers from driving it at once
+_engine_singleton = None
+_engine_lock = threading.Lock()
+
+def _get_engine():
+    """Return the shared text-to-speech engine, creating it on first use."""
+    global _engine_singleton
+    with _engine_lock:
+        if _engine_singleton is None:
+            engine = pyttsx3.init()
+            engine.setProperty('rate', 150)  # Slightly slower for better clarity
+            engine.setProperty('volume', 0.9)  # 90% volume
+            
+            # Get available voices and set a good default
+            voices = engine.getProperty('voices')
+            if voices:
+                engine.setProperty('voice', voices[0].id)
+            _engine_singleton = engine
+        return _engine_singleton
 
 class VoiceManager:
     def __init__(self):
+        # Configure logging
+        logging.basicConfig(level=logging.INFO)
+        self.logger = logging.getLogger(__name__)
+
         # Initialize speech recognizer
         self.recognizer = sr.Recognizer()
         self.recognizer.dynamic_energy_threshold = True
         self.recognizer.energy_threshold = 4000
+
+        # Prefer a local Vosk model when one is installed
+        self.vosk_model = None
+        if vosk is not None and os.path.isdir(VOSK_MODEL_PATH):
+            try:
+                vosk.SetLogLevel(-1)
+                self.vosk_model = vosk.Model(VOSK_MODEL_PATH)
+            except Exception as e:
+                self.logger.error(f"Error loading Vosk model: {e}")
         
         # Initialize text-to-speech engine
         try:
-            self.engine = pyttsx3.init()
-            self.engine.setProperty('rate', 150)  # Slightly slower for better clarity
-            self.engine.setProperty('volume', 0.9)  # 90% volume
-            
-            # Get available voices and set a good default
-            voices = self.engine.getProperty('voices')
-            if voices:
-                self.engine.setProperty('voice', voices[0].id)
+            self.engine = _get_engine()
         except Exception as e:
             self.logger.error(f"Error initializing text-to-speech: {e}")
             self.engine = None
@@ -31,11 +85,18 @@ class VoiceManager:
         self.speech_queue = queue.Queue()
         self.is_listening = False
         self.callback = None
+        # Set to stop the current listening session's threads
+        self._stop_event: Optional[threading.Event] = None
         self.last_speech_time = 0
-        
-        # Configure logging
-        logging.basicConfig(level=logging.INFO)
-        self.logger = logging.getLogger(__name__)
+        # Synthesized audio keyed by text, most recently used last:
+        # (frames, channels, sample width, frame rate)
+        self._wav_cache: 'OrderedDict[str, Tuple[bytes, int, int, int]]' = OrderedDict()
+        # Phrases spoken once but not yet cached, most recent last
+        self._seen_phrases: 'OrderedDict[str, None]' = OrderedDict()
+
+        # A single worker owns the engine; runAndWait is not reentrant
+        self._tts_thread = threading.Thread(target=self._tts_worker, daemon=True)
+        self._tts_thread.start()
 
     def start_listening(self, callback: Callable[[str], None]):
         """Start continuous listening in a separate thread."""
@@ -45,55 +106,101 @@ class VoiceManager:
             
         self.callback = callback
         self.is_listening = True
-        threading.Thread(target=self._listen_loop, daemon=True).start()
+        # Capture and recognition run in separate threads so the microphone
+        # keeps listening while a phrase is being transcribed. Each session
+        # has its own stop event and queue, so threads of a stopped session
+        # wind down even if listening is restarted before they notice.
+        stop = self._stop_event = threading.Event()
+        audio_queue = queue.Queue(maxsize=AUDIO_QUEUE_SIZE)
+        threading.Thread(target=self._listen_loop, args=(stop, audio_queue), daemon=True).start()
+        threading.Thread(target=self._recognize_loop, args=(stop, audio_queue, callback), daemon=True).start()
         self.logger.info("Started listening for voice input")
 
     def stop_listening(self):
         """Stop the continuous listening loop."""
         self.is_listening = False
+        if self._stop_event is not None:
+            self._stop_event.set()
         self.logger.info("Stopped listening for voice input")
 
-    def _listen_loop(self):
-        """Continuous listening loop that runs in a separate thread."""
-        retry_count = 0
-        max_retries = 3
-        
-        while self.is_listening:
+    def _listen_loop(self, stop: threading.Event, audio_queue: queue.Queue):
+        """Capture phrases from the microphone until the session stops."""
+        while not stop.is_set():
             try:
+                # Keep one stream open for the whole session; only reopen
+                # the device after an error
                 with sr.Microphone() as source:
-                    # Adjust for ambient noise more frequently
-                    if time.time() - self.last_speech_time > 10:  # Adjust every 10 seconds of silence
-                        self.recognizer.adjust_for_ambient_noise(source, duration=0.5)
+                    # Calibrate once; the dynamic energy threshold tracks
+                    # ambient noise from then on
+                    self.recognizer.adjust_for_ambient_noise(source, duration=0.5)
                     
-                    try:
-                        audio = self.recognizer.listen(source, timeout=5, phrase_time_limit=10)
-                        text = self.recognizer.recognize_google(audio)
-                        
-                        if text.strip():
-                            self.logger.info(f"Recognized: {text}")
-                            self.last_speech_time = time.time()
-                            retry_count = 0  # Reset retry count on successful recognition
-                            
-                            if self.callback:
-                                self.callback(text)
-                    except sr.WaitTimeoutError:
-                        continue
-                    except sr.UnknownValueError:
-                        self.logger.info("Could not understand audio")
-                        retry_count += 1
-                    except sr.RequestError as e:
-                        self.logger.error(f"Could not request results; {e}")
-                        retry_count += 1
+                    while not stop.is_set():
+                        try:
+                            audio = self.recognizer.listen(source, timeout=5, phrase_time_limit=10)
+                        except sr.WaitTimeoutError:
+                            continue
                         
-                    # If we've had too many errors, take a break
-                    if retry_count >= max_retries:
-                        self.logger.warning("Too many recognition errors, pausing briefly")
-                        time.sleep(2)
-                        retry_count = 0
+                        # Wait for room in the queue, giving up if the session stops
+                        while not stop.is_set():
+                            try:
+                                audio_queue.put(audio, timeout=1)
+                                break
+                            except queue.Full:
+                                continue
                         
             except Exception as e:
                 self.logger.error(f"Error in listen loop: {e}")
-                time.sleep(1)  # Prevent rapid retries on persistent errors
+                stop.wait(1)  # Prevent rapid retries on persistent errors
+
+    def _recognize_loop(self, stop: threading.Event, audio_queue: queue.Queue,
+                        callback: Callable[[str], None]):
+        """Transcribe captured phrases and pass them to the session's callback."""
+        retry_count = 0
+        max_retries = 3
+        
+        while not stop.is_set():
+            try:
+                audio = audio_queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            
+            try:
+                text = self._recognize(audio)
+                
+                if text.strip():
+                    self.logger.info(f"Recognized: {text}")
+                    self.last_speech_time = time.time()
+                    retry_count = 0  # Reset retry count on successful recognition
+                    
+                    if callback and not stop.is_set():
+                        callback(text)
+            except sr.UnknownValueError:
+                self.logger.info("Could not understand audio")
+                retry_count += 1
+            except sr.RequestError as e:
+                self.logger.error(f"Could not request results; {e}")
+                retry_count += 1
+            except Exception as e:
+                self.logger.error(f"Error in recognition loop: {e}")
+                
+            # If we've had too many errors, take a break
+            if retry_count >= max_retries:
+                self.logger.warning("Too many recognition errors, pausing briefly")
+                stop.wait(2)
+                retry_count = 0
+
+    def _recognize(self, audio: sr.AudioData) -> str:
+        """Transcribe audio locally with Vosk, falling back to Google."""
+        if self.vosk_model is not None:
+            recognizer = vosk.KaldiRecognizer(self.vosk_model, VOSK_SAMPLE_RATE)
+            recognizer.SetWords(True)
+            recognizer.AcceptWaveform(audio.get_raw_data(convert_rate=VOSK_SAMPLE_RATE, convert_width=2))
+            result = orjson.loads(recognizer.FinalResult())
+            text = result.get('text', '')
+            words = result.get('result') or []
+            if text and words and sum(w['conf'] for w in words) / len(words) >= VOSK_MIN_CONFIDENCE:
+                return text
+        return self.recognizer.recognize_google(audio)
 
     def speak(self, text: str):
         """Convert text to speech and play it."""
@@ -106,24 +213,66 @@ class VoiceManager:
                 return
                 
             self.speech_queue.put(text)
-            threading.Thread(target=self._process_speech_queue, daemon=True).start()
         except Exception as e:
             self.logger.error(f"Error in speak: {e}")
 
-    def _process_speech_queue(self):
-        """Process queued speech items."""
-        while not self.speech_queue.empty():
+    def _tts_worker(self):
+        """Speak queued items one at a time for the lifetime of the manager."""
+        while True:
             text = self.speech_queue.get()
             try:
                 if self.engine:
-                    self.engine.say(text)
-                    self.engine.runAndWait()
-                    time.sleep(0.5)  # Small pause between speeches
+                    wav = self._synthesize(text) if simpleaudio is not None else None
+                    if wav is not None:
+                        # Playback does not need the engine
+                        simpleaudio.play_buffer(*wav).wait_done()
+                    else:
+                        with _engine_lock:
+                            self.engine.say(text)
+                            self.engine.runAndWait()
             except Exception as e:
                 self.logger.error(f"Error in speech processing: {e}")
             finally:
                 self.speech_queue.task_done()
 
+    def _synthesize(self, text: str) -> Optional[Tuple[bytes, int, int, int]]:
+        """Return cached audio for a repeated phrase, or None to speak it directly.
+
+        Rendering to a file costs more than speaking once, so a phrase is only
+        synthesized and cached the second time it is seen.
+        """
+        wav = self._wav_cache.get(text)
+        if wav is not None:
+            self._wav_cache.move_to_end(text)
+            return wav
+
+        if text not in self._seen_phrases:
+            self._seen_phrases[text] = None
+            if len(self._seen_phrases) > TTS_SEEN_SIZE:
+                self._seen_phrases.popitem(last=False)
+            return None
+        del self._seen_phrases[text]
+
+        fd, path = tempfile.mkstemp(suffix='.wav')
+        os.close(fd)
+        try:
+            with _engine_lock:
+                self.engine.save_to_file(text, path)
+                self.engine.runAndWait()
+            with wave.open(path, 'rb') as f:
+                wav = (f.readframes(f.getnframes()), f.getnchannels(), f.getsampwidth(), f.getframerate())
+        except Exception as e:
+            # Some drivers do not write WAV; speak directly instead
+            self.logger.error(f"Error synthesizing speech to file: {e}")
+            return None
+        finally:
+            os.remove(path)
+
+        self._wav_cache[text] = wav
+        if len(self._wav_cache) > TTS_CACHE_SIZE:
+            self._wav_cache.popitem(last=False)
+        return wav
+
     def get_last_speech(self) -> Optional[str]:
         """Get the last recognized speech if available."""
         try:
@@ -131,7 +280,7 @@ class VoiceManager:
                 self.recognizer.adjust_for_ambient_noise(source, duration=0.5)
                 self.logger.info("Listening for speech...")
                 audio = self.recognizer.listen(source, timeout=5, phrase_time_limit=10)
-                text = self.recognizer.recognize_google(audio)
+                text = self._recognize(audio)
                 self.logger.info(f"Recognized: {text}")
                 return text
         except Exception as e: